@@ -1,16 +1,32 @@
 # bot.py - Message Point Tracker for @MyCAEVC_bot
+import asyncio
+import contextlib
 import logging
-import schedule
-import time
+import os
+import re
 import threading
-from datetime import datetime, timedelta
-import pytz
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from zoneinfo import ZoneInfo
 from telegram import Update
 from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
-from config import BOT_TOKEN, CHAT_ID, TARGET_BOT_USERNAME, EXPECTED_MESSAGES, MESSAGE_PATTERNS
+from config import BOT_TOKEN, CHAT_ID, TARGET_BOT_USERNAME, EXPECTED_MESSAGES, MESSAGE_PATTERNS_LOWER, USE_UTC, LOG_VERBOSE
+
+# Use the libuv-based event loop when available (must be set before the Application is built)
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
 
 # Set timezone to Malaysia
-MALAYSIA_TZ = pytz.timezone('Asia/Kuala_Lumpur')
+MALAYSIA_TZ = ZoneInfo('Asia/Kuala_Lumpur')
+
+# Timezone of hour keys. Both are whole-hour offsets, so hour buckets line up either way.
+HOUR_KEY_TZ = timezone.utc if USE_UTC else MALAYSIA_TZ
+HOUR_KEY_TZ_NAME = 'UTC' if USE_UTC else 'MYT'
 
 # Set up logging
 logging.basicConfig(
@@ -18,166 +34,171 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG if LOG_VERBOSE else logging.INFO)
+
+# Single case-insensitive pass over the message for all point patterns
+POINT_PATTERN_TYPES = dict(MESSAGE_PATTERNS_LOWER)
+POINT_RE = re.compile(
+    '|'.join(re.escape(pattern) for pattern, _ in MESSAGE_PATTERNS_LOWER),
+    re.IGNORECASE
+)
+
+# One bit per expected point; an hour's received points are stored as a bitmask
+POINT_BITS = {point: 1 << i for i, point in enumerate(EXPECTED_MESSAGES)}
+ALL_POINTS_MASK = (1 << len(EXPECTED_MESSAGES)) - 1
+
+# (status, status_emoji) labels for the hourly summary
+STATUS_COMPLETE = ("✅ COMPLETE", "🟢")
+STATUS_INCOMPLETE = ("⚠️ INCOMPLETE", "🟡")
+STATUS_NO_MESSAGES = ("❌ NO MESSAGES", "🔴")
+
+# Number of hours kept in the ring buffer
+HOURS_TO_KEEP = 24
 
 class MessagePointTracker:
     def __init__(self):
-        self.hourly_tracker = {}  # {hour_key: set of received points (P1,P2,P3,P4)}
+        # Ring buffer indexed by hour_bucket % HOURS_TO_KEEP; a slot is valid only
+        # while _ring_buckets holds the hour_bucket (hours since epoch) it belongs to
+        self._ring = [0] * HOURS_TO_KEEP  # bitmask of received points (see POINT_BITS)
+        self._ring_buckets = [-1] * HOURS_TO_KEEP
         self.application = None
+        self.summary_task = None
+        self._cached_hour_key = None
+        self._cached_hour_bucket = None  # hours since epoch for _cached_hour_key
         
     def identify_message_point(self, text):
         """Identify if message contains P1, P2, P3, or P4"""
         if not text:
             return None
-            
-        text_lower = text.lower()
         
-        for point_type, patterns in MESSAGE_PATTERNS.items():
-            for pattern in patterns:
-                if pattern.lower() in text_lower:
-                    return point_type
-        return None
+        match = POINT_RE.search(text)
+        return POINT_PATTERN_TYPES[match.group().lower()] if match else None
         
-    def get_current_hour_key(self):
-        """Get current hour as tracking key (use UTC for consistency)"""
-        return datetime.utcnow().strftime('%Y-%m-%d-%H')
+    def get_current_hour(self):
+        """Get current hour as (hour_bucket, hour_key) (hour_key in HOUR_KEY_TZ)"""
+        now = time.time()
+        bucket = int(now) // 3600
+        if bucket != self._cached_hour_bucket:
+            self._cached_hour_bucket = bucket
+            self._cached_hour_key = datetime.fromtimestamp(now, HOUR_KEY_TZ).strftime('%Y-%m-%d-%H')
+        return bucket, self._cached_hour_key
     
     def get_hour_display(self, hour_key):
         """Convert hour key to display format in Malaysia time"""
-        dt_utc = datetime.strptime(hour_key, '%Y-%m-%d-%H')
-        dt_utc = pytz.utc.localize(dt_utc)
-        dt_malaysia = dt_utc.astimezone(MALAYSIA_TZ)
+        dt_key = datetime.strptime(hour_key, '%Y-%m-%d-%H').replace(tzinfo=HOUR_KEY_TZ)
+        dt_malaysia = dt_key.astimezone(MALAYSIA_TZ)
         return dt_malaysia.strftime('%H:00-%H:59')
     
+    def record_point(self, hour_bucket, point_type):
+        """Mark a point as received, reusing the slot of the hour 24h earlier"""
+        idx = hour_bucket % HOURS_TO_KEEP
+        if self._ring_buckets[idx] != hour_bucket:
+            self._ring_buckets[idx] = hour_bucket
+            self._ring[idx] = 0
+        self._ring[idx] |= POINT_BITS[point_type]
+    
+    def get_hour_mask(self, hour_bucket):
+        """Return the received-points bitmask for an hour (0 if nothing recorded)"""
+        idx = hour_bucket % HOURS_TO_KEEP
+        return self._ring[idx] if self._ring_buckets[idx] == hour_bucket else 0
+    
+    def get_hour_points(self, hour_bucket):
+        """Return (received, missing) point lists for an hour, in EXPECTED_MESSAGES order"""
+        mask = self.get_hour_mask(hour_bucket)
+        received = [point for point, bit in POINT_BITS.items() if mask & bit]
+        missing = [point for point, bit in POINT_BITS.items() if not mask & bit]
+        return received, missing
+    
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming messages and track specific points from target bot"""
         try:
-            # Debug logging - show ALL message details
-            sender_username = update.message.from_user.username if update.message.from_user else 'None'
-            sender_first_name = update.message.from_user.first_name if update.message.from_user else 'None'
-            message_text = update.message.text[:100] if update.message.text else 'No text'
+            # Chat and sender are already checked by the handler's filters (see run_bot)
+            message_text = update.message.text
+            point_type = self.identify_message_point(message_text)
             
-            logger.info(f"📨 MESSAGE RECEIVED:")
-            logger.info(f"  Chat ID: {update.effective_chat.id}")
-            logger.info(f"  Sender username: @{sender_username}")
-            logger.info(f"  Sender first_name: {sender_first_name}")
-            logger.info(f"  Message text: {message_text}")
-            logger.info(f"  Looking for: @{TARGET_BOT_USERNAME}")
-            logger.info(f"  Expected chat: {CHAT_ID}")
-            
-            # Only process messages from the target group
-            if update.effective_chat.id != CHAT_ID:
-                logger.info(f"❌ Wrong chat - ignoring")
-                return
-                
-            # Check if sender matches target bot
-            if (update.message.from_user and 
-                update.message.from_user.username == TARGET_BOT_USERNAME):
+            if point_type:
+                hour_bucket, hour_key = self.get_current_hour()
                 
-                logger.info(f"✅ Message from target bot @{TARGET_BOT_USERNAME} detected!")
-                point_type = self.identify_message_point(message_text)
-                logger.info(f"🔍 Point detection result: {point_type}")
+                # Add point to tracker
+                self.record_point(hour_bucket, point_type)
                 
-                if point_type:
-                    hour_key = self.get_current_hour_key()
-                    
-                    # Initialize hour tracker if needed
-                    if hour_key not in self.hourly_tracker:
-                        self.hourly_tracker[hour_key] = set()
-                    
-                    # Add point to tracker
-                    self.hourly_tracker[hour_key].add(point_type)
-                    
-                    logger.info(f"🎯 SUCCESS: {point_type} logged for hour {hour_key}")
-                    logger.info(f"📊 Current hour data: {list(self.hourly_tracker[hour_key])}")
-                else:
-                    logger.info(f"❌ No P1/P2/P3/P4 pattern found in message")
-            else:
-                logger.info(f"❌ Sender @{sender_username} ≠ target @{TARGET_BOT_USERNAME} - ignoring")
+                logger.info(f"🎯 SUCCESS: {point_type} logged for hour {hour_key}")
+                logger.info(f"📊 Current hour data: {self.get_hour_points(hour_bucket)[0]}")
+            elif LOG_VERBOSE:
+                logger.debug("❌ No P1/P2/P3/P4 pattern found in message: %s",
+                             message_text[:100] if message_text else 'No text')
                 
         except Exception as e:
             logger.error(f"🚨 ERROR in handle_message: {e}")
             logger.error(f"🚨 Update object: {update}")
-            import traceback
             logger.error(f"🚨 Traceback: {traceback.format_exc()}")
     
     async def send_hourly_summary(self):
         """Send hourly summary at 59:15"""
-        current_time_utc = datetime.utcnow()
         current_time_malaysia = datetime.now(MALAYSIA_TZ)
-        hour_key = current_time_utc.strftime('%Y-%m-%d-%H')
+        hour_bucket, hour_key = self.get_current_hour()
         
         # Get received points for this hour
-        received = self.hourly_tracker.get(hour_key, set())
-        missing = set(EXPECTED_MESSAGES) - received
+        mask = self.get_hour_mask(hour_bucket)
+        received, missing = self.get_hour_points(hour_bucket)
         
         # Create summary message
         hour_display = self.get_hour_display(hour_key)
         
         # Status emoji
-        if len(received) == len(EXPECTED_MESSAGES):
-            status = "✅ COMPLETE"
-            status_emoji = "🟢"
-        elif len(received) > 0:
-            status = "⚠️ INCOMPLETE" 
-            status_emoji = "🟡"
+        if mask == ALL_POINTS_MASK:
+            status, status_emoji = STATUS_COMPLETE
+        elif mask:
+            status, status_emoji = STATUS_INCOMPLETE
         else:
-            status = "❌ NO MESSAGES"
-            status_emoji = "🔴"
+            status, status_emoji = STATUS_NO_MESSAGES
         
-        summary = f"""{status_emoji} *Hour {hour_display} Summary:*
+        summary = f"""{status_emoji} Hour {hour_display} Summary:
 
-📊 *Messages from @{TARGET_BOT_USERNAME}:*
-✅ *Received:* {', '.join(sorted(received)) if received else 'None'} ({len(received)}/4)
-❌ *Missing:* {', '.join(sorted(missing)) if missing else 'None'}
+📊 Messages from @{TARGET_BOT_USERNAME}:
+✅ Received: {', '.join(received) if received else 'None'} ({len(received)}/4)
+❌ Missing: {', '.join(missing) if missing else 'None'}
 
-*Status:* {status}
-*Time:* {current_time_malaysia.strftime('%H:%M:%S')} MYT
+Status: {status}
+Time: {current_time_malaysia.strftime('%H:%M:%S')} MYT
         """
         
-        # Send to group
+        # Send to group as plain text - the template needs no formatting or escaping
         await self.application.bot.send_message(
             chat_id=CHAT_ID,
-            text=summary,
-            parse_mode='Markdown'
+            text=summary
         )
         
-        logger.info(f"Sent summary for hour {hour_key}: {len(received)}/{len(EXPECTED_MESSAGES)} points ({list(received)})")
-        
-        # Optional: Clear old data to save memory (keep last 24 hours)
-        self.cleanup_old_data()
+        logger.info(f"Sent summary for hour {hour_key}: {len(received)}/{len(EXPECTED_MESSAGES)} points ({received})")
     
-    def cleanup_old_data(self):
-        """Remove data older than 24 hours"""
-        current_time = datetime.utcnow()
-        cutoff_time = current_time - timedelta(hours=24)
-        cutoff_key = cutoff_time.strftime('%Y-%m-%d-%H')
-        
-        keys_to_remove = [key for key in self.hourly_tracker.keys() if key < cutoff_key]
-        for key in keys_to_remove:
-            del self.hourly_tracker[key]
+    async def summary_loop(self):
+        """Send the hourly summary at 59:15 UTC, recomputing the target from wall clock each hour"""
+        last_run = None
+        while True:
+            now = datetime.now(timezone.utc)
+            next_run = now.replace(minute=59, second=15, microsecond=0)
+            # asyncio.sleep runs on the monotonic clock and may wake a hair before
+            # the wall-clock target; never fire the same target twice
+            if next_run <= now or next_run == last_run:
+                next_run += timedelta(hours=1)
+            await asyncio.sleep(max(0, (next_run - now).total_seconds()))
+            last_run = next_run
+            try:
+                await self.send_hourly_summary()
+            except Exception as e:
+                logger.error(f"Error in summary: {e}")
     
-    def schedule_summaries(self):
-        """Schedule the 59:15 summaries"""
-        schedule.every().hour.at("59:15").do(self.run_summary)
-        
-        def scheduler_thread():
-            while True:
-                schedule.run_pending()
-                time.sleep(30)  # Check every 30 seconds
-        
-        # Run scheduler in separate thread
-        threading.Thread(target=scheduler_thread, daemon=True).start()
+    async def start_summary_loop(self, application):
+        """post_init hook: run the summary loop on the bot's own event loop"""
+        self.summary_task = asyncio.create_task(self.summary_loop())
         logger.info("Scheduler started - summaries at 59:15 UTC (07:59:15 MYT)")
     
-    def run_summary(self):
-        """Wrapper to run async summary in sync context"""
-        import asyncio
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(self.send_hourly_summary())
-        except Exception as e:
-            logger.error(f"Error in summary: {e}")
+    async def stop_summary_loop(self, application):
+        """post_stop hook: cancel the summary task while the bot's HTTP client is still open"""
+        if self.summary_task:
+            self.summary_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.summary_task
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /status command for current hour progress (optional manual check)"""
@@ -189,9 +210,8 @@ class MessagePointTracker:
             logger.info(f"Status command from wrong chat. Expected: {CHAT_ID}, Got: {update.effective_chat.id}")
             return
         
-        hour_key = self.get_current_hour_key()  # This uses UTC
-        received = self.hourly_tracker.get(hour_key, set())
-        missing = set(EXPECTED_MESSAGES) - received
+        hour_bucket, hour_key = self.get_current_hour()
+        received, missing = self.get_hour_points(hour_bucket)
         
         current_time_malaysia = datetime.now(MALAYSIA_TZ)
         minutes_left = 59 - current_time_malaysia.minute
@@ -201,10 +221,10 @@ class MessagePointTracker:
 🕐 *Time:* {current_time_malaysia.strftime('%H:%M:%S')} MYT ({minutes_left} min left)
 📨 *From @{TARGET_BOT_USERNAME}:* {len(received)}/4
 
-✅ *Received:* {', '.join(sorted(received)) if received else 'None'}
-⏳ *Waiting for:* {', '.join(sorted(missing)) if missing else 'All complete!'}
+✅ *Received:* {', '.join(received) if received else 'None'}
+⏳ *Waiting for:* {', '.join(missing) if missing else 'All complete!'}
 
-*Debug:* Tracking hour {hour_key} UTC
+*Debug:* Tracking hour {hour_key} {HOUR_KEY_TZ_NAME}
         """
         
         try:
@@ -213,23 +233,32 @@ class MessagePointTracker:
         except Exception as e:
             logger.error(f"Error sending status response: {e}")
             # Try without markdown as fallback
-            simple_msg = f"Current Hour Status:\nTime: {current_time_malaysia.strftime('%H:%M:%S')} MYT ({minutes_left} min left)\nFrom @{TARGET_BOT_USERNAME}: {len(received)}/4\nReceived: {', '.join(sorted(received)) if received else 'None'}\nWaiting for: {', '.join(sorted(missing)) if missing else 'All complete!'}\nDebug: Tracking hour {hour_key} UTC"
+            simple_msg = f"Current Hour Status:\nTime: {current_time_malaysia.strftime('%H:%M:%S')} MYT ({minutes_left} min left)\nFrom @{TARGET_BOT_USERNAME}: {len(received)}/4\nReceived: {', '.join(received) if received else 'None'}\nWaiting for: {', '.join(missing) if missing else 'All complete!'}\nDebug: Tracking hour {hour_key} {HOUR_KEY_TZ_NAME}"
             await update.message.reply_text(simple_msg)
     
     def run_bot(self):
         """Start the bot"""
         # Create application
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        self.application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(self.start_summary_loop)
+            .post_stop(self.stop_summary_loop)
+            .build()
+        )
         
         # IMPORTANT: Add CommandHandler BEFORE MessageHandler
         # Commands should be processed before general messages
         self.application.add_handler(CommandHandler("status", self.status_command))
         
-        # Add message handler for tracking (only processes non-command messages)
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
-        
-        # Start scheduler for hourly summaries
-        self.schedule_summaries()
+        # Add message handler for tracking (only text from the target bot in our group;
+        # the target bot never sends commands, so no ~filters.COMMAND is needed)
+        self.application.add_handler(MessageHandler(
+            filters.TEXT
+            & filters.Chat(chat_id=CHAT_ID)
+            & filters.User(username=TARGET_BOT_USERNAME),
+            self.handle_message
+        ))
         
         logger.info(f"Bot starting... Monitoring @{TARGET_BOT_USERNAME} for hourly summaries")
         logger.info(f"Summaries at 59:15 UTC (07:59:15 MYT)")
@@ -240,14 +269,16 @@ class MessagePointTracker:
         self.start_health_server()
         
         # Run bot
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Long-poll: let getUpdates wait on the server side instead of re-polling.
+        # Only new messages are handled, so ask Telegram not to send other update types.
+        self.application.run_polling(allowed_updates=[Update.MESSAGE], timeout=30, poll_interval=0.0)
     
     def start_health_server(self):
         """Start a simple health check server for Render"""
-        import os
-        from http.server import HTTPServer, BaseHTTPRequestHandler
-        
         class HealthHandler(BaseHTTPRequestHandler):
+            # Socket timeout so a slow client can't hold a connection open
+            timeout = 5
+            
             def do_GET(self):
                 self.send_response(200)
                 self.send_header('Content-type', 'text/html')
@@ -260,7 +291,8 @@ class MessagePointTracker:
         
         def run_server():
             port = int(os.environ.get('PORT', 10000))
-            httpd = HTTPServer(('', port), HealthHandler)
+            # One (daemon) thread per request so probes don't queue behind each other
+            httpd = ThreadingHTTPServer(('', port), HealthHandler)
             logger.info(f"Health server started on port {port}")
             httpd.serve_forever()
         
@@ -6,6 +6,12 @@ BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 CHAT_ID = int(os.getenv('CHAT_ID', '-1002180864230'))
 
 TARGET_BOT_USERNAME = "MyCAEVC_bot"
+
+# Track hours in UTC (True) or Malaysia time (False)
+USE_UTC = os.getenv('USE_UTC', 'true').lower() == 'true'
+# Log message-detection details at DEBUG level
+LOG_VERBOSE = os.getenv('LOG_VERBOSE', 'false').lower() == 'true'
+
 EXPECTED_MESSAGES = ['P1', 'P2', 'P3', 'P4']
 
 MESSAGE_PATTERNS = {
@@ -14,3 +20,10 @@ MESSAGE_PATTERNS = {
     'P3': ['P3 '],
     'P4': ['P4 ']
 }
+
+# Pre-lowercased (pattern, point_type) pairs for case-insensitive matching
+MESSAGE_PATTERNS_LOWER = tuple(
+    (pattern.lower(), point_type)
+    for point_type, patterns in MESSAGE_PATTERNS.items()
+    for pattern in patterns
+)